@@ -0,0 +1,59 @@
+import os
+import json
+import orjson
+from logger import Logger as logger
+
+# Process wide copies of the cache files, keyed by their path
+_MEM_CACHE = {}
+
+
+def _cache_file_path(cache_file):
+    cache_folder = os.path.join(os.getcwd(), 'cache')
+
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+
+    return os.path.join(cache_folder, cache_file)
+
+
+# Function to load or create cache in the 'cache' folder
+def load_cache(cache_file):
+    """
+    Load a JSON cache from the 'cache' folder. The file is only read once per process,
+    later calls return the same dict so changes made by the caller are kept.
+    """
+    cache_file_path = _cache_file_path(cache_file)
+
+    if cache_file_path in _MEM_CACHE:
+        logger.info(f"Using in-memory cache for {cache_file_path}")
+        return _MEM_CACHE[cache_file_path]
+
+    if os.path.exists(cache_file_path):
+        logger.info(f"Loading cache from {cache_file_path}")
+        with open(cache_file_path, 'rb') as f:
+            cache = orjson.loads(f.read())
+    else:
+        logger.info(f"No cache found. Starting fresh.")
+        cache = {}
+
+    _MEM_CACHE[cache_file_path] = cache
+    return cache
+
+
+# Function to save cache to a file in the 'cache' folder
+def save_cache(cache, cache_file):
+    """
+    Save a cache to the 'cache' folder and keep it as the in-memory copy.
+    """
+    cache_file_path = _cache_file_path(cache_file)
+    _MEM_CACHE[cache_file_path] = cache
+
+    logger.info(f"Saving cache to {cache_file_path}")
+    # Write to a temporary file first so a crash never leaves a half written cache behind
+    tmp_file_path = cache_file_path + '.tmp'
+    # orjson only writes string keys, others (e.g. a missing city read as NaN) are converted the way json.dump did
+    if not all(isinstance(key, str) for key in cache):
+        cache = {key if isinstance(key, str) else json.dumps(key): value for key, value in cache.items()}
+    with open(tmp_file_path, 'wb') as f:
+        f.write(orjson.dumps(cache))
+    os.replace(tmp_file_path, cache_file_path)
@@ -1,32 +1,93 @@
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import matplotlib
+# Maps are only written to files, so no GUI backend is needed
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from matplotlib import cm
+from matplotlib.colors import to_hex
 import requests
+from requests.adapters import HTTPAdapter
+import aiohttp
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import time
 import os
 import json
+from urllib.parse import quote
 from logger import Logger as logger
-from collections import defaultdict
-from tqdm import tqdm
+from helpers.cache import load_cache, save_cache
+from tqdm.asyncio import tqdm_asyncio
+
+# datashader is optional, it is only needed to raster very large maps
+try:
+    import datashader as ds
+    import datashader.transfer_functions as tf
+except ImportError:
+    ds = None
+
+# Maps with more markers than this are rastered with datashader, the scatter cost grows with the markers
+# while the raster costs about the same at any size
+DATASHADER_THRESHOLD = 10000
+_DATASHADER_WIDTH = 1200
+
+# Shared session so consecutive Nominatim calls reuse the same keep-alive connection
+_SESSION = requests.Session()
+_SESSION.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'})
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# Cities Nominatim has no result for are not requested again for a week
+NEGATIVE_CACHE_TTL = 7 * 86400
+
+# Function to look a city up in the coordinate cache
+# Coordinates are stored as [lat, lon], failed lookups as {"miss": True, "ts": <unix time>}
+def _cached_coords(cache, city):
+    entry = cache.get(city) if cache else None
+    if entry is None:
+        return None
+    if isinstance(entry, dict):
+        # Expired misses are treated as uncached so the city is requested again
+        if entry.get('miss') and time.time() - entry.get('ts', 0) < NEGATIVE_CACHE_TTL:
+            return None, None
+        return None
+    return tuple(entry)
+
+# Function to remember that no coordinates were found for a city
+def _cache_miss(cache, city):
+    cache[city] = {"miss": True, "ts": time.time()}
 
 # Function to get coordinates using OpenStreetMap Nominatim API with retry logic and rate limiting
 def get_osm_coordinates(city, country="Germany", cache=None, retries=5, backoff_factor=1):
-    if cache and city in cache:
+    cached = _cached_coords(cache, city)
+    if cached is not None:
         logger.info(f"Using cached coordinates for {city}")
-        return cache[city] 
+        return cached
     
     url = f"https://nominatim.openstreetmap.org/search?q={city},{country}&format=json&limit=1"
     
     for attempt in range(retries):
         logger.info(f"Attempting to get coordinates for {city} (Attempt {attempt + 1}/{retries})")
-        response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'})
+        try:
+            response = _SESSION.get(url, timeout=10)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Request error while retrieving coordinates for {city}: {e}. Retrying...")
+            time.sleep(backoff_factor)
+            backoff_factor *= 2
+            continue
         
         if response.status_code == 200 and response.json():
             data = response.json()[0]
             lat, lon = float(data['lat']), float(data['lon'])
             logger.info(f"Successfully retrieved coordinates for {city}: (lat: {lat}, lon: {lon})")
             return lat, lon
+        elif response.status_code == 200:
+            # Only an empty answer is a definite miss, failed requests are tried again on the next run
+            logger.warning(f"No coordinates found for {city}.")
+            if cache is not None:
+                _cache_miss(cache, city)
+            return None, None
         elif response.status_code == 429:
             logger.warning(f"Rate limit hit for {city}, waiting {backoff_factor} seconds before retrying...")
             time.sleep(backoff_factor)
@@ -39,298 +100,355 @@ def get_osm_coordinates(city, country="Germany", cache=None, retries=5, backoff_
     logger.error(f"Failed to get coordinates for {city} after {retries} attempts.")
     return None, None
 
-# Function to load or create cache in the 'reporting' folder
-def load_cache(cache_file):
-    cache_folder = os.path.join(os.getcwd(), 'cache')
-    cache_file_path = os.path.join(cache_folder, cache_file)
-
-    if not os.path.exists(cache_folder):
-        os.makedirs(cache_folder)
-
-    if os.path.exists(cache_file_path):
-        logger.info(f"Loading cache from {cache_file_path}")
-        with open(cache_file_path, 'r') as f:
-            return json.load(f)
-    logger.info(f"No cache found. Starting fresh.")
-    return {}
-
-# Function to save cache to a file in the 'reporting' folder
-def save_cache(cache, cache_file):
-    cache_folder = os.path.join(os.getcwd(), 'cache')
-    cache_file_path = os.path.join(cache_folder, cache_file)
+# Function to build the URL encoded batch payload for a list of cities
+def _batch_payload(cities, country="Germany"):
+    return quote(json.dumps([{"q": f"{city},{country}"} for city in cities], separators=(',', ':')))
+
+# Function to geocode many cities at once via the (undocumented) Nominatim batch mode
+# Cities Nominatim answered with an empty result map to None, failed batches leave their cities out
+def geocode_batch(cities, country="Germany", batch_size=100, max_url_length=4000):
+    base_url = "https://nominatim.openstreetmap.org/search?format=json&batch="
+    coords = {}
+
+    # Split the cities into chunks that stay below the batch size and URL length limits
+    chunks = []
+    chunk = []
+    for city in cities:
+        if chunk and (len(chunk) >= batch_size or len(base_url) + len(_batch_payload(chunk + [city], country)) > max_url_length):
+            chunks.append(chunk)
+            chunk = []
+        chunk.append(city)
+    if chunk:
+        chunks.append(chunk)
+
+    for i, chunk in enumerate(chunks):
+        logger.info(f"Requesting batch {i + 1}/{len(chunks)} with {len(chunk)} cities")
+        results = None
+        try:
+            response = _SESSION.get(base_url + _batch_payload(chunk, country), timeout=30)
+            if response.status_code == 200:
+                data = response.json()
+                # A server without batch support ignores the parameter and answers with a plain search list
+                results = data.get('batch') if isinstance(data, dict) else None
+            else:
+                logger.error(f"Error {response.status_code} while requesting batch {i + 1}/{len(chunks)}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Batch request {i + 1}/{len(chunks)} failed: {e}")
 
-    if not os.path.exists(cache_folder):
-        os.makedirs(cache_folder)
+        if not isinstance(results, list) or len(results) != len(chunk):
+            logger.warning(f"No usable batch reply for batch {i + 1}/{len(chunks)}, falling back to single requests.")
+        else:
+            for city, result in zip(chunk, results):
+                if result:
+                    data = result[0]
+                    coords[city] = (float(data['lat']), float(data['lon']))
+                else:
+                    coords[city] = None
+
+        # Respect the Nominatim usage policy between consecutive batches
+        if i < len(chunks) - 1:
+            time.sleep(1)
+
+    logger.info(f"Batch geocoding answered {len(coords)}/{len(cities)} cities")
+    return coords
+
+# Async variant of get_osm_coordinates, the semaphore bounds how many requests are in flight
+# Returns None if Nominatim has no result for the city and (None, None) if the lookup failed
+async def fetch_coord(session, city, sem, country="Germany", retries=5, backoff_factor=1):
+    url = f"https://nominatim.openstreetmap.org/search?q={city},{country}&format=json&limit=1"
 
-    logger.info(f"Saving cache to {cache_file_path}")
-    with open(cache_file_path, 'w') as f:
-        json.dump(cache, f)
+    async with sem:
+        for attempt in range(retries):
+            logger.info(f"Attempting to get coordinates for {city} (Attempt {attempt + 1}/{retries})")
+            try:
+                async with session.get(url, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}) as response:
+                    status = response.status
+                    data = await response.json() if status == 200 else None
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.error(f"Request error while retrieving coordinates for {city}: {e}. Retrying...")
+                await asyncio.sleep(backoff_factor)
+                backoff_factor *= 2
+                continue
+
+            if status == 200 and data:
+                lat, lon = float(data[0]['lat']), float(data[0]['lon'])
+                logger.info(f"Successfully retrieved coordinates for {city}: (lat: {lat}, lon: {lon})")
+                # Keep the slot for a second to respect the Nominatim usage policy
+                await asyncio.sleep(1)
+                return lat, lon
+            elif status == 200:
+                logger.warning(f"No coordinates found for {city}.")
+                await asyncio.sleep(1)
+                return None
+            elif status == 429:
+                logger.warning(f"Rate limit hit for {city}, waiting {backoff_factor} seconds before retrying...")
+            else:
+                logger.error(f"Error {status} while retrieving coordinates for {city}. Retrying...")
+            await asyncio.sleep(backoff_factor)
+            backoff_factor *= 2
 
-# Function to generate and save the map
-def generate_germany_map(categorized_csv, output_image, cache_file='city_coords_cache.json'):
-    logger.info(f"Starting to generate map from {categorized_csv}")
-    
-    df = pd.read_csv(categorized_csv)
-    logger.info(f"Loaded CSV file with {len(df)} rows")
+    logger.error(f"Failed to get coordinates for {city} after {retries} attempts.")
+    return None, None
 
-    df_germany = df[df['Country'] == 'Germany']
-    logger.info(f"Filtered to {len(df_germany)} rows for Germany")
+# Geocode all given cities concurrently over one shared session
+async def _geocode_all(cities, country="Germany", concurrency=2):
+    sem = asyncio.Semaphore(concurrency)
+    # Same per request limit as the requests based lookups instead of aiohttp's 300 second default
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=8), timeout=aiohttp.ClientTimeout(total=10)) as session:
+        return await tqdm_asyncio.gather(*[fetch_coord(session, city, sem, country=country) for city in cities], desc="Processing cities", ncols=100)
 
+# Function to get the coordinates for the given cities, fetching only the uncached ones
+# Returns an array with one (lat, lon) row per city, NaN where no coordinates were found
+def _geocode_cities(cities, cache_file='city_coords_cache.json', country="Germany"):
     city_coords_cache = load_cache(cache_file)
-    city_coords = defaultdict(list)
 
-    # Only apply delay when calling the API (for uncached cities)
-    uncached_cities = []
-
-    logger.info(f"Fetching coordinates for {len(df_germany['City'].unique())} unique cities...")
-    
-    for city in tqdm(df_germany['City'].unique(), desc="Processing cities", ncols=100):
-        if city in city_coords_cache:
-            # Use cached coordinates
-            city_coords[city] = city_coords_cache[city]
-        else:
-            uncached_cities.append(city)
-            lat, lon = get_osm_coordinates(city, country="Germany", cache=city_coords_cache)
-            if lat and lon:
-                city_coords[city] = (lat, lon)
-                city_coords_cache[city] = (lat, lon)
-                # Only sleep when the API is hit, not for cached data
-                time.sleep(1)  
-            else:
-                logger.warning(f"Skipping city {city} due to missing coordinates.")
-
-    save_cache(city_coords_cache, cache_file)
+    # Only call the API for uncached cities
+    uncached_cities = [city for city in cities if _cached_coords(city_coords_cache, city) is None]
+
+    logger.info(f"Fetching coordinates for {len(cities)} unique cities, {len(uncached_cities)} not cached...")
+
+    if uncached_cities:
+        # The cache is saved even if a lookup fails, so the coordinates fetched so far are kept
+        try:
+            batch_coords = geocode_batch(uncached_cities, country=country)
+            for city, coords in batch_coords.items():
+                if coords is None:
+                    _cache_miss(city_coords_cache, city)
+                else:
+                    city_coords_cache[city] = coords
+            # Only the cities missing from the batch reply are requested one by one
+            uncached_cities = [city for city in uncached_cities if city not in batch_coords]
+
+            if uncached_cities:
+                results = asyncio.run(_geocode_all(uncached_cities, country=country))
+                for city, result in zip(uncached_cities, results):
+                    # A miss is only remembered when Nominatim found nothing, failed lookups are retried on the next run
+                    if result is None:
+                        _cache_miss(city_coords_cache, city)
+                    elif result[0] and result[1]:
+                        city_coords_cache[city] = result
+                    else:
+                        logger.warning(f"Skipping city {city} due to missing coordinates.")
+        finally:
+            save_cache(city_coords_cache, cache_file)
+
+    # The cache keeps {city: [lat, lon]}, the maps work on an array indexed by city code
+    city_coords = np.full((len(cities), 2), np.nan)
+    for i, city in enumerate(cities):
+        lat, lon = _cached_coords(city_coords_cache, city) or (None, None)
+        if lat is not None and lon is not None:
+            city_coords[i] = (lat, lon)
+    return city_coords
+
+# Function to load the Germany shape, the filtered GeoDataFrame is cached as a pickle next to the other caches
+@functools.lru_cache(maxsize=1)
+def _load_germany_gdf(cache_file='germany_gdf.pkl'):
+    germany_shapefile_path = "helpers/natural_earth/ne_110m_admin_0_countries.shp"
+    cache_folder = os.path.join(os.getcwd(), 'cache')
+    cache_file_path = os.path.join(cache_folder, cache_file)
 
-    city_counts = df_germany.groupby(['City', 'RE_Strategy_Names']).size().unstack(fill_value=0)
+    # Reuse the pickle unless the shapefile changed since it was written
+    if os.path.exists(cache_file_path) and os.path.getmtime(cache_file_path) >= os.path.getmtime(germany_shapefile_path):
+        logger.info(f"Loading Germany shape from {cache_file_path}")
+        return pd.read_pickle(cache_file_path)
 
-    # Load the Germany shapefile from the provided path
     logger.info("Loading Germany shapefile")
-    germany_shapefile_path = "helpers/natural_earth/ne_110m_admin_0_countries.shp"
     germany = gpd.read_file(germany_shapefile_path)
-    
     # Filter for Germany
     germany = germany[germany['SOVEREIGNT'] == 'Germany']
 
-    # Plotting the combined map for all strategies
-    logger.info("Plotting the combined map")
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    logger.info(f"Saving Germany shape to {cache_file_path}")
+    germany.to_pickle(cache_file_path)
+    return germany
+
+# Function to raster the city points over the current view and draw them as a single image
+# The points are one aggregation with one small spread, so unlike the scatter markers their size does not show the count
+def _shade_points(ax, city_points, color_key):
+    strategies = list(color_key)
+    points_df = city_points.melt(id_vars=['lon', 'lat'], value_vars=strategies, var_name='strategy', value_name='count')
+    points_df = points_df[points_df['count'] > 0]
+    if points_df.empty:
+        return None
+    points_df['strategy'] = pd.Categorical(points_df['strategy'], categories=strategies)
+
+    # The canvas covers the limits the Germany polygon set, with pixels that are square on screen
+    x_range, y_range = ax.get_xlim(), ax.get_ylim()
+    ax.apply_aspect()
+    aspect = ax.get_aspect() if ax.get_aspect() != 'auto' else 1
+    plot_height = int(round(_DATASHADER_WIDTH * aspect * (y_range[1] - y_range[0]) / (x_range[1] - x_range[0])))
+    cvs = ds.Canvas(plot_width=_DATASHADER_WIDTH, plot_height=plot_height, x_range=x_range, y_range=y_range)
+
+    agg = cvs.points(points_df, 'lon', 'lat', ds.by('strategy', ds.sum('count')))
+    # The count is shown by opacity on a log scale, the high minimum keeps light strategies visible on the grey polygon
+    img = tf.spread(tf.shade(agg, color_key=color_key, how='log', min_alpha=120), px=3)
+
+    artist = ax.imshow(img.to_pil(), extent=(*x_range, *y_range), aspect=ax.get_aspect(), zorder=2)
+    # imshow resets the limits to the image extent, keep the ones the polygon set
+    ax.set_xlim(x_range)
+    ax.set_ylim(y_range)
+    return artist
+
+# Function to render a group of single strategy maps, runs in a worker process
+def _render_strategy_maps(args):
+    germany_wkb, germany_crs, city_points, maps = args
+    germany = gpd.GeoSeries.from_wkb(germany_wkb, crs=germany_crs)
+
+    # One figure is reused for the whole group, the Germany polygon is only drawn once
     fig, ax = plt.subplots(figsize=(12, 12))
     germany.plot(ax=ax, color='lightgrey')
 
+    for strategy, color, title, output_image, shade in maps:
+        logger.info(f"Generating map for {strategy}")
+
+        if shade:
+            artist = _shade_points(ax, city_points, {strategy: color})
+        else:
+            mask = city_points[strategy] > 0
+            artist = ax.scatter(city_points.loc[mask, 'lon'].values, city_points.loc[mask, 'lat'].values, s=city_points.loc[mask, strategy].values * 50, color=color, alpha=0.6, edgecolor='black')
+
+        ax.set_title(title)
+        logger.info(f"Saving {strategy} map to {output_image}")
+        fig.savefig(output_image, dpi=300, bbox_inches='tight')
+        if artist is not None:
+            artist.remove()
+        logger.info(f"{strategy} map generation completed")
+
+    plt.close(fig)
+
+# Function to plot the combined map and one map per RE strategy for the given subset
+def _plot_strategy_map(df_subset, city_codes, city_coords, germany_gdf, output_image, individual_output_image, label=None):
+    companies = f"{label} Companies" if label else "Companies"
+    legend_title = f"RE Strategies ({label})" if label else "RE Strategies"
+
+    # Count the companies per city code and strategy in one pass, int32 is plenty for these counts
+    # Rows without a city (code -1) are left out
+    known = city_codes >= 0
+    city_counts = pd.crosstab(city_codes[known], df_subset['RE_Strategy_Names'].to_numpy()[known]).astype('int32')
+
+    # Look the coordinates up by city code, cities without coordinates are dropped
+    lat_lon = city_coords[city_counts.index.to_numpy()]
+    located = ~np.isnan(lat_lon).any(axis=1)
+    city_points = city_counts[located].assign(lat=lat_lon[located, 0], lon=lat_lon[located, 1])
+
+    fig, ax = plt.subplots(figsize=(12, 12))
+    germany_gdf.plot(ax=ax, color='lightgrey')
+
     strategies = city_counts.columns
     colors = cm.get_cmap('coolwarm', len(strategies))
 
-    for i, strategy in enumerate(strategies):
-        for city, row in city_counts.iterrows():
-            if row[strategy] > 0:
-                if city in city_coords:
-                    lat, lon = city_coords[city]
-                    ax.scatter(lon, lat, s=row[strategy] * 50, color=colors(i), alpha=0.6, edgecolor='black', label=strategy)
+    # Strategies without any located city are skipped, so no empty maps are written
+    # The colors keep their position in all strategies so they match across subsets of a run
+    counts = city_points[strategies].to_numpy()
+    nonempty = np.flatnonzero((counts > 0).any(axis=0))
+    sizes = counts * 50
+    lons = city_points['lon'].to_numpy()
+    lats = city_points['lat'].to_numpy()
 
-    # Create a legend with multiple columns and smaller marker size
-    legend_elements = [plt.Line2D([0], [0], marker='o', color='w', markerfacecolor=colors(i), markersize=8, label=strategy) for i, strategy in enumerate(strategies)]
-    
-    plt.legend(handles=legend_elements, title="RE Strategies", loc='upper left', bbox_to_anchor=(1, 1), ncol=2, fontsize='small', title_fontsize='medium')
+    # Maps with very many markers are rastered instead of drawing a marker per city and strategy
+    markers = np.count_nonzero(counts, axis=0)
+    if ds is None and markers.sum() > DATASHADER_THRESHOLD:
+        logger.warning("datashader is not installed, drawing the large map with scatter markers instead")
+    shade = ds is not None and markers.sum() > DATASHADER_THRESHOLD
+
+    # Plotting the combined map for all strategies
+    logger.info(f"Plotting the combined map for {companies.lower()}")
+    if shade:
+        _shade_points(ax, city_points, {strategies[i]: to_hex(colors(i)) for i in nonempty})
+    else:
+        for i in nonempty:
+            mask = counts[:, i] > 0
+            ax.scatter(lons[mask], lats[mask], s=sizes[mask, i], color=colors(i), alpha=0.6, edgecolor='black', label=strategies[i])
 
-    plt.title('Distribution of Companies in Germany by Circular Economy RE Strategies')
+    # Create a legend with multiple columns and smaller marker size
+    legend_elements = [plt.Line2D([0], [0], marker='o', color='w', markerfacecolor=colors(i), markersize=8, label=strategies[i]) for i in nonempty]
+    ax.legend(handles=legend_elements, title=legend_title, loc='upper left', bbox_to_anchor=(1, 1), ncol=2, fontsize='small', title_fontsize='medium')
+    ax.set_title(f'Distribution of {companies} in Germany by Circular Economy RE Strategies')
 
     logger.info(f"Saving combined map to {output_image}")
-    plt.savefig(output_image, dpi=300, bbox_inches='tight')  # Ensure everything fits within the output image
-    plt.show()
+    fig.savefig(output_image, dpi=300, bbox_inches='tight')  # Ensure everything fits within the output image
+    plt.close(fig)
     logger.info("Combined map generation completed")
 
-    # Generate individual maps for each RE strategy
-    for i, strategy in enumerate(strategies):
-        logger.info(f"Generating map for {strategy}")
-        fig, ax = plt.subplots(figsize=(12, 12))
-        germany.plot(ax=ax, color='lightgrey')
-
-        for city, row in city_counts.iterrows():
-            if row[strategy] > 0:
-                if city in city_coords:
-                    lat, lon = city_coords[city]
-                    ax.scatter(lon, lat, s=row[strategy] * 50, color=colors(i), alpha=0.6, edgecolor='black')
-
-        plt.title(f'Distribution of Companies in Germany by {strategy}')
-        individual_output_image = f"img/unvalidated/germany_{strategy}_strategy_map.png"
-        logger.info(f"Saving {strategy} map to {individual_output_image}")
-        plt.savefig(individual_output_image, dpi=300, bbox_inches='tight')
-        plt.show()
-        logger.info(f"{strategy} map generation completed")
+    # Generate individual maps for each RE strategy, split round robin over the worker processes
+    maps = [(strategies[i], to_hex(colors(i)), f'Distribution of {companies} in Germany by {strategies[i]}', individual_output_image.format(strategy=strategies[i]), ds is not None and markers[i] > DATASHADER_THRESHOLD) for i in nonempty]
+    if not maps:
+        return
+
+    # Only the polygon and the plain point columns are sent to the workers, not the GeoDataFrame
+    germany_wkb = germany_gdf.geometry.to_wkb().tolist()
+    germany_crs = germany_gdf.crs.to_wkt() if germany_gdf.crs else None
+
+    workers = min(os.cpu_count() or 1, len(maps))
+    tasks = []
+    for group in (maps[i::workers] for i in range(workers)):
+        columns = ['lon', 'lat'] + [strategy for strategy, _, _, _, _ in group]
+        tasks.append((germany_wkb, germany_crs, city_points[columns], group))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Consume the results so errors from the workers are raised here
+            list(executor.map(_render_strategy_maps, tasks))
+    else:
+        _render_strategy_maps(tasks[0])
+
+# Function to read only the columns the maps need, the repeated strings are stored as categories
+def _read_map_csv(categorized_csv, columns):
+    df = pd.read_csv(categorized_csv, usecols=columns, dtype={column: 'category' for column in columns})
+    logger.info(f"Loaded CSV file with {len(df)} rows")
+    return df
+
+# Function to build a mask for categorical values containing the given text, only the categories are scanned
+def _contains(series, text):
+    categories = series.cat.categories
+    return series.isin(categories[categories.str.contains(text)])
+
+# Function to generate and save the map
+def generate_germany_map(categorized_csv, output_image, cache_file='city_coords_cache.json'):
+    logger.info(f"Starting to generate map from {categorized_csv}")
+    
+    df = _read_map_csv(categorized_csv, ['City', 'Country', 'RE_Strategy_Names'])
+
+    df_germany = df[df['Country'] == 'Germany']
+    logger.info(f"Filtered to {len(df_germany)} rows for Germany")
+
+    city_codes, cities = pd.factorize(df_germany['City'])
+    city_coords = _geocode_cities(cities, cache_file)
+    _plot_strategy_map(df_germany, city_codes, city_coords, _load_germany_gdf(), output_image, "img/unvalidated/germany_{strategy}_strategy_map.png")
 
 def generate_germany_map_with_validation_disagree(categorized_csv, output_image, cache_file='city_coords_cache.json'):
     logger.info(f"Starting to generate map from {categorized_csv}")
     
-    df = pd.read_csv(categorized_csv)
-    logger.info(f"Loaded CSV file with {len(df)} rows")
+    df = _read_map_csv(categorized_csv, ['City', 'Country', 'RE_Strategy_Names', 'openai_agreement'])
 
     # Filter for rows where OpenAI disagrees
-    df_germany_disagreed = df[(df['Country'] == 'Germany') & (df['openai_agreement'].str.contains('Disagree'))]
+    df_germany_disagreed = df[(df['Country'] == 'Germany') & _contains(df['openai_agreement'], 'Disagree')]
     logger.info(f"Filtered to {len(df_germany_disagreed)} rows where OpenAI disagreed for Germany")
 
     if df_germany_disagreed.empty:
         logger.warning("No disagreements found in the data. Exiting map generation.")
         return
 
-    city_coords_cache = load_cache(cache_file)
-    city_coords = defaultdict(list)
-
-    # Fetch coordinates for unique cities with disagreements
-    logger.info(f"Fetching coordinates for {len(df_germany_disagreed['City'].unique())} unique cities with disagreements...")
-    
-    for city in tqdm(df_germany_disagreed['City'].unique(), desc="Processing cities", ncols=100):
-        if city in city_coords_cache:
-            # Use cached coordinates
-            city_coords[city] = city_coords_cache[city]
-        else:
-            lat, lon = get_osm_coordinates(city, country="Germany", cache=city_coords_cache)
-            if lat and lon:
-                city_coords[city] = (lat, lon)
-                city_coords_cache[city] = (lat, lon)
-                time.sleep(1)  # Rate-limiting
-            else:
-                logger.warning(f"Skipping city {city} due to missing coordinates.")
-
-    save_cache(city_coords_cache, cache_file)
-
-    # Group by City and RE_Strategy_Names
-    city_counts = df_germany_disagreed.groupby(['City', 'RE_Strategy_Names']).size().unstack(fill_value=0)
-
-    # Load the Germany shapefile
-    logger.info("Loading Germany shapefile")
-    germany_shapefile_path = "helpers/natural_earth/ne_110m_admin_0_countries.shp"
-    germany = gpd.read_file(germany_shapefile_path)
-    germany = germany[germany['SOVEREIGNT'] == 'Germany']
-
-    # Plotting the combined map for all strategies
-    logger.info("Plotting the combined map for disagreements")
-    fig, ax = plt.subplots(figsize=(12, 12))
-    germany.plot(ax=ax, color='lightgrey')
-
-    strategies = city_counts.columns
-    colors = cm.get_cmap('coolwarm', len(strategies))
-
-    for i, strategy in enumerate(strategies):
-        for city, row in city_counts.iterrows():
-            if row[strategy] > 0:
-                if city in city_coords:
-                    lat, lon = city_coords[city]
-                    ax.scatter(lon, lat, s=row[strategy] * 50, color=colors(i), alpha=0.6, edgecolor='black', label=strategy)
-
-    # Create a legend
-    legend_elements = [plt.Line2D([0], [0], marker='o', color='w', markerfacecolor=colors(i), markersize=8, label=strategy) for i, strategy in enumerate(strategies)]
-    plt.legend(handles=legend_elements, title="RE Strategies (Disagreed)", loc='upper left', bbox_to_anchor=(1, 1), ncol=2, fontsize='small', title_fontsize='medium')
-    plt.title('Distribution of Disagreed Companies in Germany by Circular Economy RE Strategies')
-
+    city_codes, cities = pd.factorize(df_germany_disagreed['City'])
+    city_coords = _geocode_cities(cities, cache_file)
     validated_output_image = output_image.replace(".png", "_with_validation.png")
-    logger.info(f"Saving validation map to {validated_output_image}")
-    plt.savefig(validated_output_image, dpi=300, bbox_inches='tight')
-    plt.show()
-    logger.info("Validation map generation completed")
-
-    # Generate individual maps for each RE strategy with disagreements
-    for i, strategy in enumerate(strategies):
-        logger.info(f"Generating map for {strategy} (Disagreements)")
-        fig, ax = plt.subplots(figsize=(12, 12))
-        germany.plot(ax=ax, color='lightgrey')
-
-        for city, row in city_counts.iterrows():
-            if row[strategy] > 0:
-                if city in city_coords:
-                    lat, lon = city_coords[city]
-                    ax.scatter(lon, lat, s=row[strategy] * 50, color=colors(i), alpha=0.6, edgecolor='black')
-
-        plt.title(f'Distribution of Disagreed Companies in Germany by {strategy}')
-        individual_output_image = f"img/validated/disagree/germany_{strategy}_strategy_map_with_validation_disagree.png"
-        logger.info(f"Saving {strategy} map to {individual_output_image}")
-        plt.savefig(individual_output_image, dpi=300, bbox_inches='tight')
-        plt.show()
-        logger.info(f"{strategy} map generation completed")
+    _plot_strategy_map(df_germany_disagreed, city_codes, city_coords, _load_germany_gdf(), validated_output_image, "img/validated/disagree/germany_{strategy}_strategy_map_with_validation_disagree.png", label="Disagreed")
 
 def generate_germany_map_with_validation_agree(categorized_csv, output_image, cache_file='city_coords_cache.json'):
     logger.info(f"Starting to generate map from {categorized_csv}")
     
-    df = pd.read_csv(categorized_csv)
-    logger.info(f"Loaded CSV file with {len(df)} rows")
+    df = _read_map_csv(categorized_csv, ['City', 'Country', 'RE_Strategy_Names', 'openai_agreement'])
 
     # Filter for rows where OpenAI agrees
-    df_germany_agreed = df[(df['Country'] == 'Germany') & (df['openai_agreement'].str.contains('Agree'))]
+    df_germany_agreed = df[(df['Country'] == 'Germany') & _contains(df['openai_agreement'], 'Agree')]
     logger.info(f"Filtered to {len(df_germany_agreed)} rows where OpenAI agreed for Germany")
 
     if df_germany_agreed.empty:
         logger.warning("No agreements found in the data. Exiting map generation.")
         return
 
-    city_coords_cache = load_cache(cache_file)
-    city_coords = defaultdict(list)
-
-    # Fetch coordinates for unique cities with agreements
-    logger.info(f"Fetching coordinates for {len(df_germany_agreed['City'].unique())} unique cities with agreements...")
-    
-    for city in tqdm(df_germany_agreed['City'].unique(), desc="Processing cities", ncols=100):
-        if city in city_coords_cache:
-            # Use cached coordinates
-            city_coords[city] = city_coords_cache[city]
-        else:
-            lat, lon = get_osm_coordinates(city, country="Germany", cache=city_coords_cache)
-            if lat and lon:
-                city_coords[city] = (lat, lon)
-                city_coords_cache[city] = (lat, lon)
-                time.sleep(1)  # Rate-limiting
-            else:
-                logger.warning(f"Skipping city {city} due to missing coordinates.")
-
-    save_cache(city_coords_cache, cache_file)
-
-    # Group by City and RE_Strategy_Names
-    city_counts = df_germany_agreed.groupby(['City', 'RE_Strategy_Names']).size().unstack(fill_value=0)
-
-    # Load the Germany shapefile
-    logger.info("Loading Germany shapefile")
-    germany_shapefile_path = "helpers/natural_earth/ne_110m_admin_0_countries.shp"
-    germany = gpd.read_file(germany_shapefile_path)
-    germany = germany[germany['SOVEREIGNT'] == 'Germany']
-
-    # Plotting the combined map for all strategies
-    logger.info("Plotting the combined map for agreements")
-    fig, ax = plt.subplots(figsize=(12, 12))
-    germany.plot(ax=ax, color='lightgrey')
-
-    strategies = city_counts.columns
-    colors = cm.get_cmap('coolwarm', len(strategies))
-
-    for i, strategy in enumerate(strategies):
-        for city, row in city_counts.iterrows():
-            if row[strategy] > 0:
-                if city in city_coords:
-                    lat, lon = city_coords[city]
-                    ax.scatter(lon, lat, s=row[strategy] * 50, color=colors(i), alpha=0.6, edgecolor='black', label=strategy)
-
-    # Create a legend
-    legend_elements = [plt.Line2D([0], [0], marker='o', color='w', markerfacecolor=colors(i), markersize=8, label=strategy) for i, strategy in enumerate(strategies)]
-    plt.legend(handles=legend_elements, title="RE Strategies (Agreed)", loc='upper left', bbox_to_anchor=(1, 1), ncol=2, fontsize='small', title_fontsize='medium')
-    plt.title('Distribution of Agreed Companies in Germany by Circular Economy RE Strategies')
-
+    city_codes, cities = pd.factorize(df_germany_agreed['City'])
+    city_coords = _geocode_cities(cities, cache_file)
     validated_output_image = output_image.replace(".png", "_with_validation_agree.png")
-    logger.info(f"Saving validation map to {validated_output_image}")
-    plt.savefig(validated_output_image, dpi=300, bbox_inches='tight')
-    plt.show()
-    logger.info("Validation map generation completed")
-
-    # Generate individual maps for each RE strategy with agreements
-    for i, strategy in enumerate(strategies):
-        logger.info(f"Generating map for {strategy} (Agreements)")
-        fig, ax = plt.subplots(figsize=(12, 12))
-        germany.plot(ax=ax, color='lightgrey')
-
-        for city, row in city_counts.iterrows():
-            if row[strategy] > 0:
-                if city in city_coords:
-                    lat, lon = city_coords[city]
-                    ax.scatter(lon, lat, s=row[strategy] * 50, color=colors(i), alpha=0.6, edgecolor='black')
-
-        plt.title(f'Distribution of Agreed Companies in Germany by {strategy}')
-        individual_output_image = f"img/validated/agree/germany_{strategy}_strategy_map_with_validation.png"
-        logger.info(f"Saving {strategy} map to {individual_output_image}")
-        plt.savefig(individual_output_image, dpi=300, bbox_inches='tight')
-        plt.show()
-        logger.info(f"{strategy} map generation completed")
\ No newline at end of file
+    _plot_strategy_map(df_germany_agreed, city_codes, city_coords, _load_germany_gdf(), validated_output_image, "img/validated/agree/germany_{strategy}_strategy_map_with_validation.png", label="Agreed")
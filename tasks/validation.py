@@ -1,13 +1,19 @@
-import os
-import json
 import pandas as pd
 from bigquery.client import BigQueryClient
 from logger import Logger as logger
+from helpers.cache import load_cache, save_cache
 from company_keywords.keywords import Keywords
 from openai_request.client import OpenAIClient
 from openai_request.openai_requests_prompt import construct_prompt
 from tasks.mapping import generate_germany_map
 
+# pyarrow is optional, it is only used for its faster CSV writer
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
 def run_job(client: OpenAIClient, bqclient: BigQueryClient, upload=False):
 
     #TODO bigquery upload
@@ -44,32 +50,25 @@ def handle_row_error(row, error_message):
     logger.error(f"Error processing row: {row}. Error: {error_message}")
     return "Error in OpenAI response"
 
-# Function to load or create cache in the 'reporting' folder
-def load_cache(cache_file):
-    cache_folder = os.path.join(os.getcwd(), 'cache')
-    cache_file_path = os.path.join(cache_folder, cache_file)
-
-    if not os.path.exists(cache_folder):
-        os.makedirs(cache_folder)
-
-    if os.path.exists(cache_file_path):
-        logger.info(f"Loading cache from {cache_file_path}")
-        with open(cache_file_path, 'r') as f:
-            return json.load(f)
-    logger.info(f"No cache found. Starting fresh.")
-    return {}
-
-# Function to save cache to a file in the 'reporting' folder
-def save_cache(cache, cache_file):
-    cache_folder = os.path.join(os.getcwd(), 'cache')
-    cache_file_path = os.path.join(cache_folder, cache_file)
-
-    if not os.path.exists(cache_folder):
-        os.makedirs(cache_folder)
-
-    logger.info(f"Saving cache to {cache_file_path}")
-    with open(cache_file_path, 'w') as f:
-        json.dump(cache, f)
+def write_csv(df, output_csv):
+    """
+    Write the DataFrame to a CSV with pyarrow's C++ writer if it is installed, otherwise with pandas.
+    Floats are written as pandas writes them (15 stays 15.0), so pd.read_csv gives the same dtypes and values.
+    The bytes still differ from the pandas output since pyarrow quotes every string field.
+    """
+    if pa is not None:
+        try:
+            # pyarrow writes whole floats without a decimal point, which pandas would read back as int
+            float_columns = df.select_dtypes('floating').columns
+            if len(float_columns):
+                df = df.assign(**{column: df[column].map(repr).where(df[column].notna(), None) for column in float_columns})
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            pa_csv.write_csv(table, output_csv, pa_csv.WriteOptions(quoting_style='needed', quoting_header='none'))
+            return
+        except (TypeError, pa.ArrowException) as e:
+            # e.g. mixed types in one column or an older pyarrow without these options
+            logger.warning(f"pyarrow could not write {output_csv}, falling back to pandas. Error: {e}")
+    df.to_csv(output_csv, index=False)
 
 def get_cache_key(company_name, city, country, strategy_code):
     """
@@ -77,10 +76,11 @@ def get_cache_key(company_name, city, country, strategy_code):
     """
     return f"{company_name}_{city}_{country}_{strategy_code}"
 
-def process_csv_and_save(input_csv, output_csv, strategy_dict, openai_client, cache_file='openai_cache.json'):
+def process_csv_and_save(input_csv, output_csv, strategy_dict, openai_client, cache_file='openai_cache.json', cache_flush_interval=50):
     """
     Reads the categorized Crunchbase CSV, sends each entry to OpenAI, and adds the strategy code and term or a disagreement message
     as new columns 'openai_agreement', 'openai_strategy', and 'openai_explanation'. Saves the new DataFrame to a CSV, using caching.
+    New responses are written to the cache every `cache_flush_interval` entries and once more when the loop ends.
     """
     logger.info(f"Loading data from {input_csv}")
     
@@ -95,74 +95,82 @@ def process_csv_and_save(input_csv, output_csv, strategy_dict, openai_client, ca
     if not validate_columns(df, required_columns):
         return
     
-    # Initialize lists for new columns
-    openai_agreements = []
-    openai_strategies = []
-    openai_explanations = []
+    # Initialize lists for new columns, filled by row position
+    openai_agreements = [None] * len(df)
+    openai_strategies = [None] * len(df)
+    openai_explanations = [None] * len(df)
+
+    # Number of new responses that are not yet written to the cache file
+    dirty = 0
 
     # Loop through each row and generate OpenAI responses
-    for _, row in df.iterrows():
-        try:
-            company_name = row['Company_Name']
-            city = row['City']
-            country = row['Country']
-            strategy_codes = row['RE_Strategy_Codes'].split(", ")
-            short_description = row['Short_Description']
-
-            # Initialize lists to store responses for this row
-            row_agreements = []
-            row_strategies = []
-            row_explanations = []
-
-            # Iterate over each strategy code
-            for strategy_code in strategy_codes:
-                # Validate strategy code
-                if not validate_strategy_code(strategy_code, strategy_dict):
-                    row_agreements.append("Invalid")
-                    row_strategies.append(f"Invalid strategy code: {strategy_code}")
-                    row_explanations.append("")
-                    continue
-
-                # Generate a unique cache key based on company and strategy
-                cache_key = get_cache_key(company_name, city, country, strategy_code)
+    try:
+        # Iterate over plain tuples of the required columns instead of boxing each row into a Series
+        for i, row in enumerate(map(tuple, df[required_columns].to_numpy())):
+            try:
+                company_name, city, country, strategy_codes_str, _, short_description = row
+                strategy_codes = strategy_codes_str.split(", ")
+
+                # Initialize lists to store responses for this row
+                row_agreements = []
+                row_strategies = []
+                row_explanations = []
+
+                # Iterate over each strategy code
+                for strategy_code in strategy_codes:
+                    # Validate strategy code
+                    if not validate_strategy_code(strategy_code, strategy_dict):
+                        row_agreements.append("Invalid")
+                        row_strategies.append(f"Invalid strategy code: {strategy_code}")
+                        row_explanations.append("")
+                        continue
+
+                    # Generate a unique cache key based on company and strategy
+                    cache_key = get_cache_key(company_name, city, country, strategy_code)
                 
-                # Check if the result is already cached
-                if cache_key in cache:
-                    logger.info(f"Using cached response for {company_name} ({strategy_code})")
-                    response = cache[cache_key]
-                else:
-                    # Construct the OpenAI prompt for each strategy
-                    messages = construct_prompt(company_name, city, country, strategy_code, short_description)
-
-                    # Get OpenAI response
-                    logger.info(f"Sending request to OpenAI for {company_name} ({strategy_code})")
-                    response = openai_client.get_openai_response(messages)
-
-                    # Cache the response
-                    cache[cache_key] = response
-                    save_cache(cache, cache_file)
-
-                # Parse the response into its structured format
-                agreement, strategy, explanation = parse_openai_response(response)
-
-                # Append the parsed values to the row-specific lists
-                row_agreements.append(agreement)
-                row_strategies.append(strategy)
-                row_explanations.append(explanation)
-
-            # Combine responses for this row into a single string
-            openai_agreements.append(", ".join(row_agreements))
-            openai_strategies.append(", ".join(row_strategies))
-            openai_explanations.append(", ".join(row_explanations))
-
-        except Exception as e:
-            openai_agreements.append("Error")
-            openai_strategies.append("Error")
-            openai_explanations.append(handle_row_error(row, str(e)))
-
-    # Validate that the number of responses matches the number of rows
-    if len(openai_agreements) != len(df):
-        raise ValueError("Length of OpenAI responses does not match the number of rows in the DataFrame.")
+                    # Check if the result is already cached
+                    if cache_key in cache:
+                        logger.info(f"Using cached response for {company_name} ({strategy_code})")
+                        response = cache[cache_key]
+                    else:
+                        # Construct the OpenAI prompt for each strategy
+                        messages = construct_prompt(company_name, city, country, strategy_code, short_description)
+
+                        # Get OpenAI response
+                        logger.info(f"Sending request to OpenAI for {company_name} ({strategy_code})")
+                        response = openai_client.get_openai_response(messages)
+
+                        # Cache the response, the file is only rewritten every few new entries
+                        cache[cache_key] = response
+                        dirty += 1
+                        if dirty >= cache_flush_interval:
+                            save_cache(cache, cache_file)
+                            dirty = 0
+
+                    # Parse the response into its structured format
+                    agreement, strategy, explanation = parse_openai_response(response)
+
+                    # Append the parsed values to the row-specific lists
+                    row_agreements.append(agreement)
+                    row_strategies.append(strategy)
+                    row_explanations.append(explanation)
+
+                # Combine responses for this row into a single string
+                openai_agreements[i] = ", ".join(row_agreements)
+                openai_strategies[i] = ", ".join(row_strategies)
+                openai_explanations[i] = ", ".join(row_explanations)
+
+            except Exception as e:
+                openai_agreements[i] = "Error"
+                openai_strategies[i] = "Error"
+                openai_explanations[i] = handle_row_error(row, str(e))
+    finally:
+        if dirty:
+            save_cache(cache, cache_file)
+
+    # Validate that every row received a response
+    if any(agreement is None for agreement in openai_agreements):
+        raise ValueError("Not every row in the DataFrame received an OpenAI response.")
 
     # Add the responses as new columns
     df['openai_agreement'] = openai_agreements
@@ -171,7 +179,7 @@ def process_csv_and_save(input_csv, output_csv, strategy_dict, openai_client, ca
 
     # Save the updated DataFrame to the output CSV
     logger.info(f"Saving new CSV with OpenAI responses to {output_csv}")
-    df.to_csv(output_csv, index=False)
+    write_csv(df, output_csv)
 
     # Explicitly delete the DataFrame and clear memory
     del df